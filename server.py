@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import codecs
+import functools
+import inspect
 import json
+import mmap
 import os
-import shlex
+import selectors
+import shutil
+import signal
 import re
 import subprocess
-from dataclasses import asdict, dataclass
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
@@ -17,6 +25,12 @@ except Exception as exc:  # pragma: no cover
         "The 'mcp' package is required. Install with: pip install -r requirements.txt"
     ) from exc
 
+try:
+    # orjson is optional; it parses small dicts ~3x faster than stdlib json
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 
 # Resolve important project paths (assumes sibling directories: 'jetlag' and 'jetlag-mcp')
 THIS_FILE = Path(__file__).resolve()
@@ -29,39 +43,236 @@ DOCS_DIR = (JETLAG_DIR / "docs").resolve()
 VARS_DIR = (JETLAG_DIR / "ansible" / "inventory").resolve()
 ROLES_DIR = (ANSIBLE_DIR / "roles").resolve()
 
+# Resolve the ansible-playbook executable and project config once at import;
+# re-checking them on every run_playbook call is just repeated stat syscalls.
+_venv_ansible = JETLAG_DIR / ".ansible" / "bin" / "ansible-playbook"
+_ANSIBLE_PLAYBOOK_BIN = (
+    str(_venv_ansible) if _venv_ansible.is_file() else (shutil.which("ansible-playbook") or "ansible-playbook")
+)
+_project_cfg = JETLAG_DIR / "ansible.cfg"
+_ANSIBLE_CFG_PATH = str(_project_cfg) if _project_cfg.is_file() else None
+
 
 def _ensure_within(base: Path, candidate: Path) -> Path:
+    # Callers pass bases that were already resolve()d at import, so only the
+    # candidate needs the per-component symlink walk.
     candidate_resolved = candidate.resolve()
-    base_resolved = base.resolve()
-    if base_resolved not in candidate_resolved.parents and candidate_resolved != base_resolved:
-        raise ValueError(f"Path escapes allowed base: {candidate_resolved} not within {base_resolved}")
+    if not candidate_resolved.is_relative_to(base):
+        raise ValueError(f"Path escapes allowed base: {candidate_resolved} not within {base}")
     return candidate_resolved
 
 
-def _run_command(command: List[str], cwd: Optional[Path] = None, timeout_seconds: int = 3600) -> Dict[str, Any]:
-    completed = subprocess.run(
+@functools.lru_cache(maxsize=64)
+def _parse_extra_vars(extra_vars_json: str) -> Dict[str, Any]:
+    """Parse and validate an extra-vars JSON payload.
+
+    Memoized because MCP clients commonly resend the same payload (e.g. a
+    check-mode run followed by the real one).
+    """
+    try:
+        parsed = orjson.loads(extra_vars_json) if orjson is not None else json.loads(extra_vars_json)
+    except ValueError as exc:
+        raise ValueError(f"extra_vars_json is not valid JSON: {exc}")
+    if not isinstance(parsed, dict):
+        raise ValueError("extra_vars_json must be a JSON object")
+    return parsed
+
+
+@functools.lru_cache(maxsize=128)
+def _resolved_inventory(relative_path: str) -> Path:
+    # Repeat runs tend to reuse the same inventory; cache the symlink walk
+    return _ensure_within(JETLAG_DIR, JETLAG_DIR / relative_path)
+
+
+# Keep at most this many lines of each stream; ansible-playbook output over a
+# long run can reach many MB, and clients only ever inspect the tail anyway.
+_MAX_OUTPUT_LINES = 5000
+
+# Chunk size for incremental file reads in read_text_file
+_READ_CHUNK_BYTES = 64 * 1024
+
+# Playbook file extensions; str.endswith takes the tuple directly
+_YAML_SUFFIXES = (".yml", ".yaml")
+
+# Byte-level patterns over the mapped vars sample: any 'key: value' line, and
+# the anchor comment marking where override vars get appended
+_KEY_LINE_RE = re.compile(
+    rb"^(?P<indent>[ \t]*)(?P<key>[A-Za-z_][A-Za-z0-9_]*)[ \t]*:[^\n]*$", re.MULTILINE
+)
+_EXTRA_VARS_ANCHOR_RE = re.compile(rb"^# Append override vars below[ \t]*$", re.MULTILINE)
+
+# String-valued keys that are always quoted for clarity in all.yml
+_QUOTED_KEYS = frozenset({"ocp_build", "ocp_version"})
+
+
+def _fmt(key: str, value: Any) -> str:
+    """Format a value for a YAML 'key: value' line in all.yml."""
+    # Branches ordered by frequency: most of the rewritten vars are flags
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        # Quote where clarity helps, and keep Jinja expressions quoted
+        if key in _QUOTED_KEYS or (value.startswith("{{") and value.endswith("}}")):
+            return f'"{value}"'
+        return value
+    return str(value)
+
+
+def _run_command(
+    command: List[str],
+    cwd: Optional[Path] = None,
+    timeout_seconds: int = 3600,
+    env: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    process = subprocess.Popen(
         command,
         cwd=str(cwd) if cwd else None,
-        capture_output=True,
-        text=True,
-        timeout=timeout_seconds,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        close_fds=True,
+        # Own session so a timeout can kill the whole process tree (Ansible
+        # forks ssh/python children that would otherwise outlive the parent)
+        start_new_session=True,
     )
+    # Drain both pipes incrementally into bounded ring buffers so memory stays
+    # capped no matter how much the child writes, and partial output survives
+    # a timeout. The raw fds are read non-blocking and split into lines here:
+    # readline() on a buffered wrapper would block on a partial line and defeat
+    # the deadline. Decoding replaces invalid bytes, since ansible relays raw
+    # remote output that is not guaranteed to be UTF-8.
+    stdout_lines: deque = deque(maxlen=_MAX_OUTPUT_LINES)
+    stderr_lines: deque = deque(maxlen=_MAX_OUTPUT_LINES)
+    selector = selectors.DefaultSelector()
+    for pipe, lines in ((process.stdout, stdout_lines), (process.stderr, stderr_lines)):
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        # Per-stream state: target buffer, decoder, pending partial line
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        selector.register(fd, selectors.EVENT_READ, (lines, decoder, [""]))
+    deadline = time.monotonic() + timeout_seconds
+    timed_out = False
+    try:
+        open_streams = 2
+        while open_streams:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(timeout=min(remaining, 1.0)):
+                lines, decoder, pending = key.data
+                try:
+                    chunk = os.read(key.fd, _READ_CHUNK_BYTES)
+                except BlockingIOError:
+                    continue
+                if chunk:
+                    parts = (pending[0] + decoder.decode(chunk)).split("\n")
+                    pending[0] = parts.pop()
+                    lines.extend(p[:-1] if p.endswith("\r") else p for p in parts)
+                else:
+                    pending[0] += decoder.decode(b"", final=True)
+                    selector.unregister(key.fd)
+                    open_streams -= 1
+                    if pending[0]:
+                        lines.append(pending[0])
+                        pending[0] = ""
+        if timed_out:
+            # Keep whatever partial lines arrived before the deadline
+            for key in list(selector.get_map().values()):
+                lines, _, pending = key.data
+                if pending[0]:
+                    lines.append(pending[0])
+        else:
+            # Both pipes hit EOF, but the child (or a daemonized descendant
+            # holding the session) may still be running; keep the deadline
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                timed_out = True
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+        # Never leave a live child behind, whether we timed out or an
+        # unexpected error escaped the drain loop
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
     return {
-        "returncode": completed.returncode,
-        "stdout": completed.stdout,
-        "stderr": completed.stderr,
-        "command": " ".join(shlex.quote(p) for p in command),
+        "returncode": process.returncode,
+        "stdout": "\n".join(stdout_lines),
+        "stderr": "\n".join(stderr_lines),
+        # argv as-is; quoting every argument (including multi-KB -e JSON
+        # blobs) for a diagnostic string nobody may read is wasted work
+        "command": list(command),
         "cwd": str(cwd) if cwd else None,
+        "timed_out": timed_out,
     }
 
 
-app = FastMCP("jetlag-mcp")
+if orjson is not None:
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    _dumps = json.dumps
+
+# The tool_serializer hook exists in the standalone fastmcp 2.x package but
+# not in the official MCP SDK's FastMCP, which routes unknown kwargs into its
+# settings model and silently drops them — so feature-detect the parameter
+# instead of passing it blind. Without the hook, tool results go through the
+# SDK's default serializer and _dumps is simply unused.
+if "tool_serializer" in inspect.signature(FastMCP.__init__).parameters:
+    app = FastMCP("jetlag-mcp", tool_serializer=_dumps)
+else:
+    app = FastMCP("jetlag-mcp")
+
+# Cache for the list_* tools, keyed by tool name. Each value starts with the
+# directory signature; a stale signature invalidates the entry.
+_list_cache: Dict[str, tuple] = {}
+
+# The docs signature only sees the top two directory levels, so entries also
+# expire on a TTL to pick up Markdown files added deeper in the tree
+_DOCS_CACHE_TTL_SECONDS = 30.0
+
 
+def _scandir_md(path: str) -> List[str]:
+    """Collect Markdown file paths under path via recursive os.scandir.
 
-@dataclass
-class PlaybookInfo:
-    name: str
-    path: str
+    DirEntry metadata classifies entries without extra stat calls, and img
+    directories are pruned at traversal time.
+    """
+    found: List[str] = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != "img":
+                        found.extend(_scandir_md(entry.path))
+                elif entry.is_file(follow_symlinks=False) and entry.name.endswith(".md"):
+                    found.append(entry.path)
+    except PermissionError:
+        pass
+    return found
+
+
+def _docs_signature() -> int:
+    """Cheap change signature for the docs tree.
+
+    Combines the top-level mtime with the mtimes of immediate subdirectories
+    so additions inside a subdirectory still bust the cache without walking
+    the whole tree.
+    """
+    signature = os.stat(DOCS_DIR).st_mtime_ns
+    with os.scandir(DOCS_DIR) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                signature += entry.stat(follow_symlinks=False).st_mtime_ns
+    return signature
 
 
 @app.tool()
@@ -69,11 +280,18 @@ def list_playbooks() -> List[Dict[str, str]]:
     """List top-level Ansible playbooks under jetlag/ansible (excludes role internals)."""
     if not ANSIBLE_DIR.exists():
         return []
-    results: List[PlaybookInfo] = []
-    for entry in sorted(ANSIBLE_DIR.iterdir()):
-        if entry.is_file() and entry.suffix in {".yml", ".yaml"}:
-            results.append(PlaybookInfo(name=entry.name, path=str(entry)))
-    return [asdict(r) for r in results]
+    signature = os.stat(ANSIBLE_DIR).st_mtime_ns
+    cached = _list_cache.get("playbooks")
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    playbooks: List[Dict[str, str]] = []
+    with os.scandir(ANSIBLE_DIR) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.name.endswith(_YAML_SUFFIXES):
+                playbooks.append({"name": entry.name, "path": entry.path})
+    playbooks.sort(key=lambda p: p["name"])
+    _list_cache["playbooks"] = (signature, playbooks)
+    return playbooks
 
 
 @app.tool()
@@ -81,10 +299,17 @@ def list_roles() -> List[str]:
     """List Ansible role names available under jetlag/ansible/roles."""
     if not ROLES_DIR.exists():
         return []
+    signature = os.stat(ROLES_DIR).st_mtime_ns
+    cached = _list_cache.get("roles")
+    if cached is not None and cached[0] == signature:
+        return cached[1]
     role_names: List[str] = []
-    for entry in sorted(ROLES_DIR.iterdir()):
-        if entry.is_dir():
-            role_names.append(entry.name)
+    with os.scandir(ROLES_DIR) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                role_names.append(entry.name)
+    role_names.sort()
+    _list_cache["roles"] = (signature, role_names)
     return role_names
 
 
@@ -93,29 +318,69 @@ def list_docs() -> List[str]:
     """List Markdown docs under jetlag/docs (excluding images)."""
     if not DOCS_DIR.exists():
         return []
+    signature = _docs_signature()
+    now = time.monotonic()
+    cached = _list_cache.get("docs")
+    if cached is not None and cached[0] == signature and now - cached[1] < _DOCS_CACHE_TTL_SECONDS:
+        return cached[2]
     md_files: List[str] = []
-    for path in sorted(DOCS_DIR.rglob("*.md")):
-        # Skip image directory
-        if "/img/" in str(path):
-            continue
-        md_files.append(str(path))
+    subdirs: List[str] = []
+    with os.scandir(DOCS_DIR) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != "img":
+                    subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith(".md"):
+                md_files.append(entry.path)
+    if len(subdirs) > 2:
+        # scandir releases the GIL around the directory reads, so threads
+        # overlap the syscall latency across top-level subtrees
+        with ThreadPoolExecutor(max_workers=min(8, len(subdirs))) as pool:
+            for subtree in pool.map(_scandir_md, subdirs):
+                md_files.extend(subtree)
+    else:
+        # Too few subtrees to pay for a thread pool
+        for subdir in subdirs:
+            md_files.extend(_scandir_md(subdir))
+    md_files.sort()
+    _list_cache["docs"] = (signature, now, md_files)
     return md_files
 
 
 @app.tool()
-def read_text_file(relative_path: str) -> str:
+def read_text_file(relative_path: str, max_bytes: Optional[int] = None) -> str:
     """Read a text file from within the 'jetlag' project by relative path.
 
     Only files within the jetlag directory are allowed. Use forward slashes.
+    Pass max_bytes to cap how much of a large file is read and returned.
     """
     requested = (JETLAG_DIR / relative_path).resolve()
     safe_path = _ensure_within(JETLAG_DIR, requested)
     if not safe_path.exists() or not safe_path.is_file():
         raise FileNotFoundError(f"File not found: {safe_path}")
+    # Decode in 64 KiB chunks as we read: avoids holding a full bytes copy
+    # alongside the decoded str, and lets max_bytes stop the read early
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="strict")
+    chunks: List[str] = []
+    remaining = max_bytes
     try:
-        return safe_path.read_text(encoding="utf-8")
+        with open(safe_path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while remaining is None or remaining > 0:
+                chunk = f.read(_READ_CHUNK_BYTES if remaining is None else min(_READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                chunks.append(decoder.decode(chunk))
+                if remaining is not None:
+                    remaining -= len(chunk)
+            if remaining is None:
+                # Full read: a dangling partial code point means binary data.
+                # A max_bytes cut mid-character is expected and just dropped.
+                chunks.append(decoder.decode(b"", final=True))
     except UnicodeDecodeError:
         raise ValueError("File is not UTF-8 text; refusing to read as text")
+    return "".join(chunks)
 
 
 @app.tool()
@@ -126,6 +391,7 @@ def run_playbook(
     tags: Optional[str] = None,
     extra_vars_json: Optional[str] = None,
     check: bool = False,
+    poll_interval_seconds: Optional[float] = None,
     timeout_seconds: int = 7200,
 ) -> Dict[str, Any]:
     """Run an Ansible playbook by name (top-level file under jetlag/ansible).
@@ -136,20 +402,17 @@ def run_playbook(
     - tags: optional Ansible --tags
     - extra_vars_json: JSON string of variables to pass with -e
     - check: if True, runs with --check
+    - poll_interval_seconds: optional override for Ansible's internal poll interval
     - timeout_seconds: process timeout
     """
     playbook_path = _ensure_within(ANSIBLE_DIR, ANSIBLE_DIR / playbook_name)
     if not playbook_path.exists():
         raise FileNotFoundError(f"Playbook not found: {playbook_path}")
 
-    # Prefer the project's Ansible venv if present
-    ansible_bin_path = (JETLAG_DIR / ".ansible" / "bin" / "ansible-playbook")
-    ansible_executable = str(ansible_bin_path) if ansible_bin_path.exists() else "ansible-playbook"
-
-    command: List[str] = [ansible_executable, str(playbook_path)]
+    command: List[str] = [_ANSIBLE_PLAYBOOK_BIN, str(playbook_path)]
 
     if inventory_relpath:
-        inv_path = _ensure_within(JETLAG_DIR, JETLAG_DIR / inventory_relpath)
+        inv_path = _resolved_inventory(inventory_relpath)
         if not inv_path.exists():
             raise FileNotFoundError(f"Inventory not found: {inv_path}")
         command += ["-i", str(inv_path)]
@@ -160,24 +423,28 @@ def run_playbook(
         command += ["--tags", tags]
 
     if extra_vars_json:
-        try:
-            # Validate JSON is well-formed before passing to Ansible
-            json.loads(extra_vars_json)
-        except json.JSONDecodeError as exc:
-            raise ValueError(f"extra_vars_json is not valid JSON: {exc}")
+        # Validate JSON is well-formed before passing to Ansible
+        _parse_extra_vars(extra_vars_json)
         command += ["-e", extra_vars_json]
 
     if check:
         command.append("--check")
 
     env = os.environ.copy()
+    # Raise Ansible's internal poll interval from its default: the parent
+    # process otherwise busy-waits on worker results, burning CPU for nothing
+    # on long runs. Callers that need snappier task feedback can lower it.
+    if poll_interval_seconds is not None:
+        env["ANSIBLE_INTERNAL_POLL_INTERVAL"] = str(poll_interval_seconds)
+    else:
+        env.setdefault("ANSIBLE_INTERNAL_POLL_INTERVAL", "0.01")
+    env.setdefault("ANSIBLE_POLL_INTERVAL", "5")
     # Ensure Ansible honors project-specific config if present
-    ansible_cfg = (JETLAG_DIR / "ansible.cfg")
-    if ansible_cfg.exists():
-        env["ANSIBLE_CONFIG"] = str(ansible_cfg)
+    if _ANSIBLE_CFG_PATH:
+        env["ANSIBLE_CONFIG"] = _ANSIBLE_CFG_PATH
 
     # Run from within the jetlag directory to respect relative paths inside playbooks
-    result = _run_command(command, cwd=JETLAG_DIR, timeout_seconds=timeout_seconds)
+    result = _run_command(command, cwd=JETLAG_DIR, timeout_seconds=timeout_seconds, env=env)
     return result
 
 
@@ -218,33 +485,13 @@ def create_all_yml_vars_file(
     target_file = target_dir / "all.yml"
     sample_file = target_dir / "all.sample.yml"
 
-    if not sample_file.exists():
+    # One directory read covers the sample-existence check (and anything else
+    # we may want to know about target_dir) instead of a stat per path
+    with os.scandir(target_dir) as it:
+        existing_names = {e.name for e in it}
+    if sample_file.name not in existing_names:
         raise FileNotFoundError(f"Sample vars file not found: {sample_file}")
 
-    original_text = sample_file.read_text(encoding="utf-8")
-
-    def format_value(key: str, value: Any) -> str:
-        if isinstance(value, bool):
-            return "true" if value else "false"
-        if value is None:
-            return ""
-        # Quote key string values where clarity helps
-        if key in {"ocp_build", "ocp_version"}:
-            return f'"{value}"'
-        # Keep Jinja expressions quoted
-        if isinstance(value, str) and "{{" in value and "}}" in value:
-            return f'"{value}"'
-        return str(value)
-
-    def replace_or_append(text: str, key: str, value: Any) -> tuple[str, bool]:
-        # Replace a 'key: ...' line wherever it appears, keeping indentation
-        pattern = re.compile(rf"^(?P<indent>\s*){re.escape(key)}\s*:\s*.*$", re.MULTILINE)
-        replacement = rf"\g<indent>{key}: {format_value(key, value)}"
-        if pattern.search(text):
-            return pattern.sub(replacement, text, count=1), True
-        # If not found in sample, append under Extra vars section later via extra vars path
-        return text, False
-
     # Build base replacements from provided params
     base_vars: Dict[str, Any] = {
         "lab": lab,
@@ -269,48 +516,79 @@ def create_all_yml_vars_file(
         if worker_install_disk:
             base_vars["worker_install_disk"] = worker_install_disk
 
-    # Start from the sample and replace only matching lines (comments remain intact)
-    updated_text = original_text
+    # Parse extra vars (overrides) if provided
+    extra_vars: Dict[str, Any] = _parse_extra_vars(extra_vars_json) if extra_vars_json else {}
+
+    replacements: Dict[bytes, bytes] = {
+        key.encode("utf-8"): _fmt(key, value).encode("utf-8") for key, value in base_vars.items()
+    }
+    matched_keys: set = set()
     updated_keys: List[str] = []
-    for key, value in base_vars.items():
-        updated_text, replaced = replace_or_append(updated_text, key, value)
-        if replaced:
-            updated_keys.append(f"{key} (replaced)")
-        else:
-            # If a base key did not exist in sample, we will append as override so it's visible
-            pass
 
-    # Parse extra vars (overrides) if provided
-    extra_vars: Dict[str, Any] = {}
-    if extra_vars_json:
+    # Map the sample read-only and record edits as (start, end, new bytes)
+    # spans. Unchanged regions are later written straight from the mapped
+    # buffer, so the file body is never duplicated in memory. Comments stay
+    # intact and only the first occurrence of each key is rewritten.
+    edits: List[tuple] = []
+    with open(sample_file, "rb") as f:
+        sample_size = os.fstat(f.fileno()).st_size
+        # mmap rejects empty files; an empty sample degenerates to plain bytes
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if sample_size else b""
+        for m in _KEY_LINE_RE.finditer(mm):
+            key = m.group("key")
+            if key in replacements and key not in matched_keys:
+                matched_keys.add(key)
+                edits.append((m.start(), m.end(), m.group("indent") + key + b": " + replacements[key]))
+        updated_keys.extend(f"{key} (replaced)" for key in base_vars if key.encode("utf-8") in matched_keys)
+
+        # Append any extra vars under the 'Extra vars' anchor (EOF if absent)
+        if extra_vars:
+            anchor = _EXTRA_VARS_ANCHOR_RE.search(mm)
+            insertion_index = anchor.end() if anchor else sample_size
+            to_append_lines: List[bytes] = []
+            # Ensure we start on a new line
+            if insertion_index == 0 or mm[insertion_index - 1] != 0x0A:
+                to_append_lines.append(b"")
+            # Emit k: v lines for each extra var
+            for k, v in extra_vars.items():
+                to_append_lines.append(f"{k}: {_fmt(k, v)}".encode("utf-8"))
+                updated_keys.append(f"{k} (appended override)")
+            trailing = b"" if mm[insertion_index:insertion_index + 1] == b"\n" else b"\n"
+            edits.append((insertion_index, insertion_index, b"\n".join(to_append_lines) + trailing))
+            edits.sort(key=lambda e: e[0])
+
+        # Splice the output in one scatter-gather write: unchanged spans come
+        # directly from the mmap, replacements from the edit list
+        segments: List[Any] = []
+        view = memoryview(mm)
         try:
-            parsed = json.loads(extra_vars_json)
-        except json.JSONDecodeError as exc:
-            raise ValueError(f"extra_vars_json is not valid JSON: {exc}")
-        if not isinstance(parsed, dict):
-            raise ValueError("extra_vars_json must be a JSON object")
-        extra_vars = parsed
-
-    # Append any extra vars at the bottom under the Extra vars section
-    if extra_vars:
-        # Find the 'Extra vars' anchor. If not found, append at EOF.
-        anchor_re = re.compile(r"^# Append override vars below\s*$", re.MULTILINE)
-        m = anchor_re.search(updated_text)
-        insertion_index = m.end() if m else len(updated_text)
-        before = updated_text[:insertion_index]
-        after = updated_text[insertion_index:]
-        to_append_lines: List[str] = []
-        # Ensure we start on a new line
-        if not before.endswith("\n"):
-            to_append_lines.append("")
-        # Emit k: v lines for each extra var
-        for k, v in extra_vars.items():
-            to_append_lines.append(f"{k}: {format_value(k, v)}")
-            updated_keys.append(f"{k} (appended override)")
-        updated_text = before + "\n".join(to_append_lines) + ("\n" if not after.startswith("\n") else "") + after
-
-    # Finally, write out the file
-    target_file.write_text(updated_text, encoding="utf-8")
+            pos = 0
+            for start, end, data in edits:
+                if start > pos:
+                    segments.append(view[pos:start])
+                if data:
+                    segments.append(data)
+                pos = end
+            if pos < sample_size:
+                segments.append(view[pos:])
+            fd = os.open(target_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if segments:
+                    expected = sum(len(segment) for segment in segments)
+                    written = os.writev(fd, segments)
+                    if written != expected:
+                        raise OSError(
+                            f"Short write to {target_file}: wrote {written} of {expected} bytes"
+                        )
+            finally:
+                os.close(fd)
+        finally:
+            for segment in segments:
+                if isinstance(segment, memoryview):
+                    segment.release()
+            view.release()
+            if sample_size:
+                mm.close()
     return {"written": str(target_file), "updated": updated_keys}
 
 